@@ -0,0 +1,13 @@
+"""
+Names of the predefined Aruco dictionaries and their OpenCV ids.
+
+Built once at import so that scripts and the node don't have to look the
+ids up through cv2.aruco themselves.
+"""
+
+import cv2
+
+DICT_IDS = {name: getattr(cv2.aruco, name)
+            for name in dir(cv2.aruco)
+            if name.startswith("DICT")
+            and isinstance(getattr(cv2.aruco, name), int)}
@@ -27,14 +27,19 @@ def main():
                         help='Amount of bits to use')
     parser.add_argument('--seed', default=0, type=int,
                         help='The seed used to generate the dictionary')
+    parser.add_argument('--png-compression', default=1, type=int,
+                        choices=range(10), metavar='[0-9]',
+                        help='PNG compression level, higher is smaller but slower')
 
     args = parser.parse_args()
 
     dictionary = cv2.aruco.Dictionary_create(args.num, args.bits, args.seed)
+    write_params = [cv2.IMWRITE_PNG_COMPRESSION, args.png_compression]
+    # drawMarker overwrites every pixel, so one buffer serves all markers
+    image = np.empty((args.size, args.size), dtype=np.uint8)
     for i in range(args.num):
-        image = np.zeros((args.size, args.size), dtype=np.uint8)
         image = cv2.aruco.drawMarker(dictionary, i, args.size, image, 1)
-        cv2.imwrite("marker_{:04d}.png".format(i), image)
+        cv2.imwrite("marker_{:04d}.png".format(i), image, write_params)
 
 
 if __name__ == "__main__":
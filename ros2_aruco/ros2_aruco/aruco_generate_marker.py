@@ -8,6 +8,7 @@ Version: 10/26/2020
 import argparse
 import cv2
 import numpy as np
+from ros2_aruco._dict_ids import DICT_IDS
 
 
 class CustomFormatter(argparse.ArgumentDefaultsHelpFormatter,
@@ -23,7 +24,7 @@ def main():
                         help='Marker id to generate')
     parser.add_argument('--size', default=200, type=int,
                         help='Side length in pixels')
-    dict_options = [s for s in dir(cv2.aruco) if s.startswith("DICT")]
+    dict_options = list(DICT_IDS)
     option_str = ", ".join(dict_options)
     dict_help = "Dictionary to use. Valid options include: {}".format(option_str)
     parser.add_argument('--dictionary', default="DICT_5X5_250", type=str,
@@ -31,7 +32,7 @@ def main():
                         help=dict_help, metavar='')
     args = parser.parse_args()
 
-    dictionary_id = cv2.aruco.__getattribute__(args.dictionary)
+    dictionary_id = DICT_IDS[args.dictionary]
     dictionary = cv2.aruco.Dictionary_get(dictionary_id)
     image = np.zeros((args.size, args.size), dtype=np.uint8)
     image = cv2.aruco.drawMarker(dictionary, args.id, args.size, image, 1)
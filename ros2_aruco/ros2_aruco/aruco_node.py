@@ -21,19 +21,43 @@ Parameters:
     image_topic - image topic to subscribe to (default /camera/image_raw)
     camera_info_topic - camera info topic to subscribe to
                          (default /camera/camera_info)
+    use_aruco3_detection - use the faster Aruco3 detection pipeline
+                           (default True)
+    min_side_length_canonical_img - Aruco3 side length in pixels of the
+                                    downsampled image used for candidate
+                                    search (default 32)
+    min_marker_length_ratio_original_img - Aruco3 minimum marker side length
+                                           relative to the image size, higher
+                                           is faster but misses small markers
+                                           (default 0.0)
+    opencv_num_threads - number of threads OpenCV may use, -1 lets OpenCV
+                         decide (default 1)
+    detect_scale - factor in (0, 1] by which images are downscaled before
+                   detection (default 1.0)
+    refine_on_fullres - refine the rescaled corners on the full resolution
+                        image when detect_scale < 1 (default False)
+    max_frame_age_sec - images older than this are dropped, 0 disables the
+                        check (default 0.1)
 
 Author: Nathan Sprague
 Version: 10/26/2020
 
 """
 
+import copy
+import queue
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
 import rclpy
 import rclpy.node
 from rclpy.qos import qos_profile_sensor_data
+from rclpy.time import Time
 from cv_bridge import CvBridge
 import numpy as np
 import cv2
-from ros2_aruco import transformations
+from ros2_aruco._dict_ids import DICT_IDS
 
 from sensor_msgs.msg import CameraInfo
 from sensor_msgs.msg import Image
@@ -43,64 +67,113 @@ from ros2_aruco_interfaces.msg import ArucoMarkers, ChArUcoBoard
 from tf2_ros import TransformBroadcaster
 
 
+# OpenCV 4.7 replaced the detectMarkers free function with ArucoDetector,
+# and Dictionary_create/CharucoBoard_create with extendDictionary and the
+# CharucoBoard constructor
+_HAS_ARUCO_DETECTOR = hasattr(cv2.aruco, 'ArucoDetector')
+
+_CORNER_REFINEMENT_METHODS = {
+    'CORNER_REFINE_NONE': cv2.aruco.CORNER_REFINE_NONE,
+    'CORNER_REFINE_SUBPIX': cv2.aruco.CORNER_REFINE_SUBPIX,
+    'CORNER_REFINE_CONTOUR': cv2.aruco.CORNER_REFINE_CONTOUR,
+    'CORNER_REFINE_APRILTAG': cv2.aruco.CORNER_REFINE_APRILTAG,
+}
+
+# Image encodings decoded without cv_bridge: channel count and the
+# conversion to mono8 (None if the data can be used as is)
+_COLOR_CONVERSIONS = {
+    'mono8': (1, None),
+    'bgr8': (3, cv2.COLOR_BGR2GRAY),
+    'rgb8': (3, cv2.COLOR_RGB2GRAY),
+}
+
+# Termination criteria for refining rescaled corners on the full image
+_SUBPIX_CRITERIA = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER,
+                    30, 0.01)
+
+
+def quaternions_from_rvecs(rvecs):
+    """
+    Convert a batch of Rodrigues rotation vectors to quaternions.
+
+    Takes anything that reshapes to an (N, 3) array of rotation vectors,
+    as returned by estimatePoseSingleMarkers, and returns an (N, 4) array
+    of quaternions in (x, y, z, w) order.
+    """
+    rvecs = np.asarray(rvecs, dtype=np.float64).reshape(-1, 3)
+    theta = np.linalg.norm(rvecs, axis=1)
+    quats = np.empty((rvecs.shape[0], 4), dtype=np.float64)
+    # sin(theta / 2) / theta, written with sinc so that theta == 0 is safe
+    quats[:, 0:3] = rvecs * (0.5 * np.sinc(theta / (2 * np.pi)))[:, None]
+    quats[:, 3] = np.cos(theta / 2)
+    return quats
+
+
 class ArucoNode(rclpy.node.Node):
 
     def __init__(self):
         super().__init__('aruco_node')
 
         # Declare and read parameters
-        self.declare_parameter("marker_size", .0625)
-        self.declare_parameter("aruco_dictionary_id", "DICT_5X5_250")
-        self.declare_parameter("image_topic", "/camera/image_raw")
-        self.declare_parameter("camera_info_topic", "/camera/camera_info")
-        self.declare_parameter("camera_frame", None)
-        self.declare_parameter("dictionary_bits", -1)
-        self.declare_parameter("dictionary_size", -1)
-        self.declare_parameter("dictionary_seed", 0)
-        self.declare_parameter("do_corner_refinement", False)
-        self.declare_parameter("publish_tf", False)
-        self.declare_parameter("publish_charuco_pose", False)
-        self.declare_parameter("charuco_square_x", 7)
-        self.declare_parameter("charuco_square_y", 5)
-        self.declare_parameter("charuco_square_length", 0.1)
-        self.declare_parameter("corner_refinement_method",
-                               "CORNER_REFINE_NONE")
-
-        self.marker_size = self.get_parameter("marker_size").\
-            get_parameter_value().double_value
-        dictionary_id_name = self.get_parameter(
-            "aruco_dictionary_id").get_parameter_value().string_value
-        image_topic = self.get_parameter("image_topic").\
-            get_parameter_value().string_value
-        info_topic = self.get_parameter("camera_info_topic").\
-            get_parameter_value().string_value
-        self.camera_frame = self.get_parameter("camera_frame").\
-            get_parameter_value().string_value
+        params = {p.name: p.value for p in self.declare_parameters('', [
+            ("marker_size", .0625),
+            ("aruco_dictionary_id", "DICT_5X5_250"),
+            ("image_topic", "/camera/image_raw"),
+            ("camera_info_topic", "/camera/camera_info"),
+            ("camera_frame", None),
+            ("dictionary_bits", -1),
+            ("dictionary_size", -1),
+            ("dictionary_seed", 0),
+            ("do_corner_refinement", False),
+            ("publish_tf", False),
+            ("publish_charuco_pose", False),
+            ("charuco_square_x", 7),
+            ("charuco_square_y", 5),
+            ("charuco_square_length", 0.1),
+            ("corner_refinement_method", "CORNER_REFINE_APRILTAG"),
+            ("use_aruco3_detection", True),
+            ("min_side_length_canonical_img", 32),
+            ("min_marker_length_ratio_original_img", 0.0),
+            ("opencv_num_threads", 1),
+            ("detect_scale", 1.0),
+            ("refine_on_fullres", False),
+            ("max_frame_age_sec", 0.1),
+        ])}
+
+        # Configure OpenCV threading before any other OpenCV call
+        cv2.setNumThreads(params["opencv_num_threads"])
+
+        self.marker_size = params["marker_size"]
+        dictionary_id_name = params["aruco_dictionary_id"]
+        image_topic = params["image_topic"]
+        info_topic = params["camera_info_topic"]
+        self.camera_frame = params["camera_frame"]
 
         # Make sure we have a valid dictionary id:
         if dictionary_id_name != "CUSTOM":
             try:
-                dictionary_id = cv2.aruco.__getattribute__(dictionary_id_name)
-                if type(dictionary_id) != type(cv2.aruco.DICT_5X5_100):
-                    raise AttributeError
-            except AttributeError:
+                dictionary_id = DICT_IDS[dictionary_id_name]
+            except KeyError:
                 self.get_logger().error(
                     'bad aruco_dictionary_id: {}'.format(dictionary_id_name))
-                options = "\n".join(
-                    [s for s in dir(cv2.aruco) if s.startswith("DICT")])
+                options = "\n".join(DICT_IDS)
                 self.get_logger().error("valid options: {}".format(options))
+                raise ValueError(
+                    'bad aruco_dictionary_id: {}'.format(
+                        dictionary_id_name)) from None
 
-            self.aruco_dictionary = cv2.aruco.Dictionary_get(dictionary_id)
+            self.aruco_dictionary = cv2.aruco.getPredefinedDictionary(
+                dictionary_id)
         else:
-            dict_bits = self.get_parameter("dictionary_bits").\
-                get_parameter_value().integer_value
-            dict_size = self.get_parameter("dictionary_size").\
-                get_parameter_value().integer_value
-            dict_seed = self.get_parameter("dictionary_seed").\
-                get_parameter_value().integer_value
-            self.aruco_dictionary = cv2.aruco.Dictionary_create(dict_bits,
-                                                                dict_size,
-                                                                dict_seed)
+            dict_bits = params["dictionary_bits"]
+            dict_size = params["dictionary_size"]
+            dict_seed = params["dictionary_seed"]
+            if _HAS_ARUCO_DETECTOR:
+                self.aruco_dictionary = cv2.aruco.extendDictionary(
+                    dict_size, dict_bits, randomSeed=dict_seed)
+            else:
+                self.aruco_dictionary = cv2.aruco.Dictionary_create(
+                    dict_size, dict_bits, dict_seed)
 
         # Set up subscriptions
         self.info_sub = self.create_subscription(CameraInfo,
@@ -108,8 +181,11 @@ class ArucoNode(rclpy.node.Node):
                                                  self.info_callback,
                                                  qos_profile_sensor_data)
 
+        # Only the newest image is of interest, older ones would be stale
+        image_qos = copy.copy(qos_profile_sensor_data)
+        image_qos.depth = 1
         self.create_subscription(Image, image_topic,
-                                 self.image_callback, qos_profile_sensor_data)
+                                 self.image_callback, image_qos)
 
         # Set up publishers
         self.poses_pub = self.create_publisher(PoseArray, 'aruco_poses', 10)
@@ -122,198 +198,378 @@ class ArucoNode(rclpy.node.Node):
         self.intrinsic_mat = None
         self.distortion = None
 
-        self.aruco_parameters = cv2.aruco.DetectorParameters_create()
+        # Output buffer for color to mono conversion, sized on first use
+        self._mono_buf = None
+
+        if _HAS_ARUCO_DETECTOR:
+            self.aruco_parameters = cv2.aruco.DetectorParameters()
+        else:
+            self.aruco_parameters = cv2.aruco.DetectorParameters_create()
         self.bridge = CvBridge()
 
-        if self.get_parameter("do_corner_refinement").\
-                get_parameter_value().bool_value:
-            corner_refinement_methods = [
-                'CORNER_REFINE_NONE',
-                'CORNER_REFINE_SUBPIX',
-                'CORNER_REFINE_CONTOUR',
-                'CORNER_REFINE_APRILTAG'
-            ]
-            corner_refinement_method_value = self.\
-                get_parameter("corner_refinement_method").\
-                get_parameter_value().string_value
-            corner_refinement_method_index = corner_refinement_methods.\
-                index(corner_refinement_method_value)
-            self.aruco_parameters.cornerRefinementMethod = \
-                corner_refinement_method_index
-
-        self.publish_tf = self.get_parameter("publish_tf").\
-            get_parameter_value().bool_value
+        if params["use_aruco3_detection"]:
+            if hasattr(self.aruco_parameters, 'useAruco3Detection'):
+                self.aruco_parameters.useAruco3Detection = True
+                self.aruco_parameters.minSideLengthCanonicalImg = \
+                    params["min_side_length_canonical_img"]
+                self.aruco_parameters.minMarkerLengthRatioOriginalImg = \
+                    params["min_marker_length_ratio_original_img"]
+            else:
+                self.get_logger().warn(
+                    "Aruco3 detection requires OpenCV 4.6 or newer, "
+                    "falling back to the default detector")
 
-        if self.publish_tf:
-            self.br = TransformBroadcaster(self)
+        if params["do_corner_refinement"]:
+            corner_refinement_method_value = params["corner_refinement_method"]
+            try:
+                self.aruco_parameters.cornerRefinementMethod = \
+                    _CORNER_REFINEMENT_METHODS[corner_refinement_method_value]
+            except KeyError:
+                self.get_logger().error(
+                    'bad corner_refinement_method: {}'.format(
+                        corner_refinement_method_value))
+                options = "\n".join(_CORNER_REFINEMENT_METHODS)
+                self.get_logger().error("valid options: {}".format(options))
+                raise ValueError(
+                    'bad corner_refinement_method: {}'.format(
+                        corner_refinement_method_value)) from None
+
+            if self.aruco_parameters.cornerRefinementMethod == \
+                    cv2.aruco.CORNER_REFINE_APRILTAG:
+                # Full resolution quads and small clusters suit typical
+                # camera resolutions
+                self.aruco_parameters.aprilTagQuadDecimate = 1.0
+                self.aruco_parameters.aprilTagMinClusterPixels = 5
+
+        # ArucoDetector copies the parameters, so create it once they are
+        # all set
+        if _HAS_ARUCO_DETECTOR:
+            self.aruco_detector = cv2.aruco.ArucoDetector(
+                self.aruco_dictionary, self.aruco_parameters)
+        else:
+            self.aruco_detector = None
 
-        self.publish_charuco_pose = self.\
-            get_parameter("publish_charuco_pose").\
-            get_parameter_value().bool_value
+        self.detect_scale = params["detect_scale"]
+        if not 0.0 < self.detect_scale <= 1.0:
+            self.get_logger().error(
+                'detect_scale must be in (0, 1], got {}; using 1.0'.format(
+                    self.detect_scale))
+            self.detect_scale = 1.0
 
-        self.charuco_square_x = self.\
-            get_parameter("charuco_square_x").\
-            get_parameter_value().integer_value
+        self.refine_on_fullres = params["refine_on_fullres"]
 
-        self.charuco_square_y = self.\
-            get_parameter("charuco_square_x").\
-            get_parameter_value().integer_value
+        self.max_frame_age = params["max_frame_age_sec"]
 
-        self.charuco_square_length = self.\
-            get_parameter("charuco_square_length").\
-            get_parameter_value().double_value
+        self.publish_tf = params["publish_tf"]
+
+        if self.publish_tf:
+            self.br = TransformBroadcaster(self)
+            self.marker_frame_ids = [
+                f"marker_{i}"
+                for i in range(self.aruco_dictionary.bytesList.shape[0])]
+
+        self.publish_charuco_pose = params["publish_charuco_pose"]
+        self.charuco_square_x = params["charuco_square_x"]
+        self.charuco_square_y = params["charuco_square_y"]
+        self.charuco_square_length = params["charuco_square_length"]
 
         if self.publish_charuco_pose:
+            if _HAS_ARUCO_DETECTOR:
+                self.charuco_board = cv2.aruco.CharucoBoard(
+                    (self.charuco_square_x, self.charuco_square_y),
+                    self.charuco_square_length,
+                    self.marker_size,
+                    self.aruco_dictionary)
+            else:
+                self.charuco_board = cv2.aruco.CharucoBoard_create(
+                    self.charuco_square_x,
+                    self.charuco_square_y,
+                    self.charuco_square_length,
+                    self.marker_size,
+                    self.aruco_dictionary)
             self.charuco_pose_pub = self.create_publisher(ChArUcoBoard,
                                                           'charuco_pose',
                                                           10)
+            self.charuco_executor = ThreadPoolExecutor(max_workers=1)
+
+        # Detection runs on its own thread so that the executor is not
+        # blocked; only the most recent image is kept waiting.
+        self.frame_queue = queue.Queue(maxsize=1)
+        self.detection_thread = threading.Thread(target=self.detection_loop,
+                                                 daemon=True)
+        self.detection_thread.start()
+
+    def destroy_node(self):
+        self.enqueue_frame(None)
+        self.detection_thread.join()
+        if self.publish_charuco_pose:
+            self.charuco_executor.shutdown()
+        return super().destroy_node()
 
     def info_callback(self, info_msg):
+        self.intrinsic_mat = np.array(info_msg.k,
+                                      dtype=np.float64).reshape(3, 3)
+        self.distortion = np.array(info_msg.d, dtype=np.float64)
+        # Set last: image_callback uses info_msg to tell that the camera
+        # parameters are ready for the detection thread
         self.info_msg = info_msg
-        self.intrinsic_mat = np.reshape(np.array(self.info_msg.k), (3, 3))
-        self.distortion = np.array(self.info_msg.d)
         # Assume that camera parameters will remain the same...
         self.destroy_subscription(self.info_sub)
 
+    def image_to_mono(self, img_msg):
+        """
+        Return the image message as a single channel uint8 array.
+
+        mono8 images are wrapped without copying and bgr8/rgb8 images are
+        converted into a reused buffer. Any other encoding goes through
+        cv_bridge.
+        """
+        if img_msg.encoding not in _COLOR_CONVERSIONS:
+            return self.bridge.imgmsg_to_cv2(img_msg,
+                                             desired_encoding='mono8')
+
+        channels, conversion = _COLOR_CONVERSIONS[img_msg.encoding]
+        image = np.frombuffer(img_msg.data, dtype=np.uint8).reshape(
+            img_msg.height, img_msg.step)[:, :img_msg.width * channels]
+        if conversion is None:
+            return image
+
+        image = image.reshape(img_msg.height, img_msg.width, channels)
+        if self._mono_buf is None or \
+                self._mono_buf.shape != image.shape[:2]:
+            self._mono_buf = np.empty(image.shape[:2], dtype=np.uint8)
+        return cv2.cvtColor(image, conversion, dst=self._mono_buf)
+
+    def corners_to_fullres(self, corners, detect_image, cv_image):
+        """
+        Map corners found in detect_image back to cv_image.
+
+        cv2.resize aligns pixel centers, so the mapping is applied to
+        coordinates shifted by half a pixel. The scale is taken per axis
+        from the actual image sizes, since resize rounds the output size.
+        When refine_on_fullres is set the rescaled corners are refined
+        with cornerSubPix on the full resolution image.
+        """
+        scale = np.array([cv_image.shape[1] / detect_image.shape[1],
+                          cv_image.shape[0] / detect_image.shape[0]],
+                         dtype=np.float32)
+        fullres = (np.concatenate(corners).reshape(-1, 1, 2) + 0.5) * \
+            scale - 0.5
+        if self.refine_on_fullres:
+            cv2.cornerSubPix(cv_image, fullres, (5, 5), (-1, -1),
+                             _SUBPIX_CRITERIA)
+        return tuple(fullres.reshape(-1, 1, 4, 2))
+
     def image_callback(self, img_msg):
         if self.info_msg is None:
             self.get_logger().warn("No camera info has been received!")
             return
 
-        cv_image = self.bridge.imgmsg_to_cv2(img_msg,
-                                             desired_encoding='mono8')
+        if self.is_stale(img_msg):
+            return
+
+        self.enqueue_frame(img_msg)
+
+    def is_stale(self, img_msg):
+        """Check whether the image is older than max_frame_age_sec."""
+        if self.max_frame_age <= 0.0:
+            return False
+        stamp = img_msg.header.stamp
+        if stamp.sec == 0 and stamp.nanosec == 0:
+            return False
+        clock = self.get_clock()
+        age = (clock.now() - Time.from_msg(
+            stamp, clock_type=clock.clock_type)).nanoseconds / 1e9
+        if age > self.max_frame_age:
+            self.get_logger().warn(
+                "Dropping image that is {:.3f}s old".format(age),
+                throttle_duration_sec=1.0)
+            return True
+        return False
+
+    def enqueue_frame(self, item):
+        """Hand an item to the detection thread, dropping any stale frame."""
+        try:
+            self.frame_queue.put_nowait(item)
+        except queue.Full:
+            try:
+                self.frame_queue.get_nowait()
+            except queue.Empty:
+                pass
+            self.frame_queue.put_nowait(item)
+
+    def detection_loop(self):
+        """Process queued images until a None sentinel is received."""
+        while True:
+            img_msg = self.frame_queue.get()
+            if img_msg is None:
+                return
+            # The image may have gone stale while waiting in the queue
+            if self.is_stale(img_msg):
+                continue
+            try:
+                self.process_image(img_msg)
+            except Exception:
+                self.get_logger().error(
+                    "Failed to process image:\n{}".format(
+                        traceback.format_exc()),
+                    throttle_duration_sec=1.0)
+
+    def process_image(self, img_msg):
+        cv_image = self.image_to_mono(img_msg)
+        # Convert once here rather than letting each OpenCV call copy
+        # (e.g. mono8 images with padded rows)
+        if cv_image.dtype != np.uint8 or \
+                not cv_image.flags['C_CONTIGUOUS']:
+            cv_image = np.ascontiguousarray(cv_image, dtype=np.uint8)
+        camera_frame_id = self.camera_frame or self.info_msg.header.frame_id
         markers = ArucoMarkers()
         pose_array = PoseArray()
-        if self.camera_frame is None:
-            markers.header.frame_id = self.info_msg.header.frame_id
-            pose_array.header.frame_id = self.info_msg.header.frame_id
-        else:
-            markers.header.frame_id = self.camera_frame
-            pose_array.header.frame_id = self.camera_frame
+        markers.header.frame_id = camera_frame_id
+        pose_array.header.frame_id = camera_frame_id
 
         markers.header.stamp = img_msg.header.stamp
         pose_array.header.stamp = img_msg.header.stamp
 
-        corners, \
-            marker_ids, \
-            rejected = \
-            cv2.aruco.detectMarkers(cv_image,
-                                    self.aruco_dictionary,
-                                    parameters=self.aruco_parameters)
+        if self.detect_scale < 1.0:
+            # An explicit size makes the mapping the exact ratio of the
+            # image sizes, which corners_to_fullres relies on
+            height, width = cv_image.shape[:2]
+            detect_size = (max(1, round(width * self.detect_scale)),
+                           max(1, round(height * self.detect_scale)))
+            detect_image = cv2.resize(cv_image, detect_size,
+                                      interpolation=cv2.INTER_AREA)
+        else:
+            detect_image = cv_image
+
+        if self.aruco_detector is not None:
+            corners, \
+                marker_ids, \
+                rejected = self.aruco_detector.detectMarkers(detect_image)
+        else:
+            corners, \
+                marker_ids, \
+                rejected = \
+                cv2.aruco.detectMarkers(detect_image,
+                                        self.aruco_dictionary,
+                                        parameters=self.aruco_parameters)
         if marker_ids is not None:
 
-            if cv2.__version__ > '4.0.0':
-                rvecs, \
-                    tvecs, \
-                    _ = cv2.aruco.estimatePoseSingleMarkers(corners,
-                                                            self.marker_size,
-                                                            self.intrinsic_mat,
-                                                            self.distortion)
-            else:
-                rvecs, \
-                    tvecs = \
-                    cv2.aruco.estimatePoseSingleMarkers(corners,
-                                                        self.marker_size,
-                                                        self.intrinsic_mat,
-                                                        self.distortion)
-
-            for i, marker_id in enumerate(marker_ids):
-                pose = Pose()
-                pose.position.x = tvecs[i][0][0]
-                pose.position.y = tvecs[i][0][1]
-                pose.position.z = tvecs[i][0][2]
-
-                rot_matrix = np.eye(4)
-                rot_matrix[0:3, 0:3] = cv2.Rodrigues(np.array(rvecs[i][0]))[0]
-                quat = transformations.quaternion_from_matrix(rot_matrix)
-
-                pose.orientation.x = quat[0]
-                pose.orientation.y = quat[1]
-                pose.orientation.z = quat[2]
-                pose.orientation.w = quat[3]
-
-                pose_array.poses.append(pose)
-                markers.poses.append(pose)
-                markers.marker_ids.append(marker_id[0])
-
-                if self.publish_tf:
+            if self.detect_scale < 1.0:
+                corners = self.corners_to_fullres(corners, detect_image,
+                                                  cv_image)
+
+            # The board pose only depends on the detected corners, so
+            # estimate it while the marker poses are computed here.
+            # OpenCV releases the GIL, so both run in parallel.
+            if self.publish_charuco_pose:
+                charuco_future = self.charuco_executor.submit(
+                    self.estimate_charuco_pose, corners, marker_ids, cv_image)
+
+            # Newer OpenCV versions also return the marker object points,
+            # older ones only the rotation and translation vectors
+            estimate = cv2.aruco.estimatePoseSingleMarkers(corners,
+                                                           self.marker_size,
+                                                           self.intrinsic_mat,
+                                                           self.distortion)
+            rvecs, tvecs = estimate[0], estimate[1]
+
+            positions = np.asarray(tvecs).reshape(-1, 3).tolist()
+            orientations = quaternions_from_rvecs(rvecs).tolist()
+
+            poses = [Pose() for _ in range(len(marker_ids))]
+            for pose, position, quat in zip(poses, positions, orientations):
+                pose.position.x, pose.position.y, pose.position.z = position
+                pose.orientation.x, pose.orientation.y, \
+                    pose.orientation.z, pose.orientation.w = quat
+
+            pose_array.poses = poses
+            markers.poses = poses
+            markers.marker_ids = marker_ids.ravel().tolist()
+
+            if self.publish_tf:
+                tf_msgs = []
+                for marker_id, position, quat in zip(markers.marker_ids,
+                                                     positions,
+                                                     orientations):
                     t = TransformStamped()
 
                     t.header.stamp = img_msg.header.stamp
-                    t.header.frame_id = self.camera_frame or \
-                        self.info.msg.header.frame_id
-                    t.child_frame_id = f"marker_{marker_id[0]}"
-                    t.transform.translation.x = pose.position.x
-                    t.transform.translation.y = pose.position.y
-                    t.transform.translation.z = pose.position.z
+                    t.header.frame_id = camera_frame_id
+                    t.child_frame_id = self.marker_frame_ids[marker_id]
+                    t.transform.translation.x = position[0]
+                    t.transform.translation.y = position[1]
+                    t.transform.translation.z = position[2]
                     t.transform.rotation.x = quat[0]
                     t.transform.rotation.y = quat[1]
                     t.transform.rotation.z = quat[2]
                     t.transform.rotation.w = quat[3]
 
-                    self.br.sendTransform(t)
+                    tf_msgs.append(t)
+
+                self.br.sendTransform(tf_msgs)
 
             self.poses_pub.publish(pose_array)
             self.markers_pub.publish(markers)
 
             if self.publish_charuco_pose:
-                board = cv2.aruco.CharucoBoard_create(self.charuco_square_x,
-                                                      self.charuco_square_y,
-                                                      self.charuco_square_length,
-                                                      self.marker_size,
-                                                      self.aruco_dictionary)
-                n_corners, \
-                    ch_corners, \
-                    ch_ids = cv2.aruco.interpolateCornersCharuco(corners,
-                                                                 marker_ids,
-                                                                 cv_image,
-                                                                 board=board)
-
-                if n_corners > 0:
-                    success, \
-                        rvec, \
-                        tvec = cv2.aruco.estimatePoseCharucoBoard(
-                            ch_corners,
-                            ch_ids,
-                            board,
-                            self.intrinsic_mat,
-                            self.distortion,
-                            None,
-                            None)
-
-                    if success:
-                        board_msg = ChArUcoBoard()
-                        board_msg.pose.position.x = tvec[0][0]
-                        board_msg.pose.position.y = tvec[1][0]
-                        board_msg.pose.position.z = tvec[2][0]
-
-                        rot_matrix = np.eye(4)
-                        rot_matrix[0:3, 0:3] = cv2.Rodrigues(np.array(rvec))[0]
-                        quat = transformations.quaternion_from_matrix(rot_matrix)
-
-                        board_msg.pose.orientation.x = quat[0]
-                        board_msg.pose.orientation.y = quat[1]
-                        board_msg.pose.orientation.z = quat[2]
-                        board_msg.pose.orientation.w = quat[3]
-
-                        self.charuco_pose_pub.publish(board_msg)
-
-                        if self.publish_tf:
-                            t = TransformStamped()
-
-                            t.header.stamp = img_msg.header.stamp
-                            t.header.frame_id = self.camera_frame or \
-                                self.info.msg.header.frame_id
-                            t.child_frame_id = "charuco_board"
-                            t.transform.translation.x = tvec[0][0]
-                            t.transform.translation.y = tvec[1][0]
-                            t.transform.translation.z = tvec[2][0]
-                            t.transform.rotation.x = quat[0]
-                            t.transform.rotation.y = quat[1]
-                            t.transform.rotation.z = quat[2]
-                            t.transform.rotation.w = quat[3]
-
-                            self.br.sendTransform(t)
+                board_pose = charuco_future.result()
+                if board_pose is not None:
+                    rvec, tvec = board_pose
+                    board_msg = ChArUcoBoard()
+                    board_msg.pose.position.x = tvec[0][0]
+                    board_msg.pose.position.y = tvec[1][0]
+                    board_msg.pose.position.z = tvec[2][0]
+
+                    quat = quaternions_from_rvecs(rvec)[0]
+
+                    board_msg.pose.orientation.x = quat[0]
+                    board_msg.pose.orientation.y = quat[1]
+                    board_msg.pose.orientation.z = quat[2]
+                    board_msg.pose.orientation.w = quat[3]
+
+                    self.charuco_pose_pub.publish(board_msg)
+
+                    if self.publish_tf:
+                        t = TransformStamped()
+
+                        t.header.stamp = img_msg.header.stamp
+                        t.header.frame_id = camera_frame_id
+                        t.child_frame_id = "charuco_board"
+                        t.transform.translation.x = tvec[0][0]
+                        t.transform.translation.y = tvec[1][0]
+                        t.transform.translation.z = tvec[2][0]
+                        t.transform.rotation.x = quat[0]
+                        t.transform.rotation.y = quat[1]
+                        t.transform.rotation.z = quat[2]
+                        t.transform.rotation.w = quat[3]
+
+                        self.br.sendTransform(t)
+
+    def estimate_charuco_pose(self, corners, marker_ids, cv_image):
+        """Return the (rvec, tvec) of the ChArUco board, or None."""
+        n_corners, \
+            ch_corners, \
+            ch_ids = cv2.aruco.interpolateCornersCharuco(
+                corners,
+                marker_ids,
+                cv_image,
+                board=self.charuco_board)
+
+        if n_corners > 0:
+            success, \
+                rvec, \
+                tvec = cv2.aruco.estimatePoseCharucoBoard(
+                    ch_corners,
+                    ch_ids,
+                    self.charuco_board,
+                    self.intrinsic_mat,
+                    self.distortion,
+                    None,
+                    None)
+            if success:
+                return rvec, tvec
+        return None
 
 
 def main():
@@ -9,6 +9,7 @@ import argparse
 import cv2
 import os
 from cv2 import aruco
+from ros2_aruco._dict_ids import DICT_IDS
 
 
 def main():
@@ -40,7 +41,7 @@ def main():
     parser.add_argument('--out-y',
                         type=int,
                         help='Number of pixels for output, in Y direction. If not specified, 300 * SQUARE_Y')  # noqa
-    dict_options = [s for s in dir(cv2.aruco) if s.startswith("DICT")]
+    dict_options = list(DICT_IDS)
     option_str = ", ".join(dict_options)
     dict_help = f"Dictionary to use. Valid options include: {option_str}"
     parser.add_argument('--dictionary',
@@ -53,12 +54,12 @@ def main():
     args.out_y = args.out_y or 300 * args.square_y
 
     try:
-        dictionary_id = cv2.aruco.__getattribute__(args.dictionary)
+        dictionary_id = DICT_IDS[args.dictionary]
         dictionary = cv2.aruco.Dictionary_get(dictionary_id)
-    except AttributeError:
+    except KeyError:
         print(f'unrecognized dictionary id: {args.dictionary}')
         print('Valid options:')
-        for s in [s for s in dir(cv2.aruco) if s.startswith('DICT')]:
+        for s in DICT_IDS:
             print(s)
         return
 